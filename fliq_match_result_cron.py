@@ -11,16 +11,31 @@ Behavior:
 """
 from __future__ import annotations
 
+import functools
+import hashlib
 import json
 import os
 import re
 import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timezone
 from pathlib import Path
-from typing import Any, Dict, List, Optional
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
 
 import requests
 from dotenv import load_dotenv
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+try:
+    import orjson
+except ImportError:  # optional speedup; fall back to stdlib json
+    orjson = None
+
+try:
+    import ijson
+except ImportError:  # optional; without it the response is decoded in one go
+    ijson = None
 
 load_dotenv()
 
@@ -31,6 +46,9 @@ BASE_MARKET_URL = os.getenv("BASE_MARKET_URL", "https://www.fliq.one/#/multi-que
 
 MATCHES_FILE = Path(os.getenv("MATCHES_FILE", "upcoming_match_results.json"))
 REMOVED_LOG_PATH = Path(os.getenv("REMOVED_LOG_PATH", "removed_markets.log"))
+FETCH_CACHE_FILE = Path(os.getenv("FETCH_CACHE_FILE", str(MATCHES_FILE.with_name(".fetch_cache.json"))))
+
+REMOVED_LOG_VERBOSE = os.getenv("REMOVED_LOG_VERBOSE", "false").lower() in ("1", "true", "yes")
 
 FETCH_LIMIT = int(os.getenv("FETCH_LIMIT", "1000"))
 REQUIRE_APPROVED = os.getenv("REQUIRE_APPROVED", "true").lower() in ("1", "true", "yes")
@@ -43,6 +61,22 @@ TELEGRAM_CHAT_ID_RAW = os.getenv("TELEGRAM_CHAT_ID", "").strip()
 TELEGRAM_CHAT_ID: Optional[int] = int(TELEGRAM_CHAT_ID_RAW) if TELEGRAM_CHAT_ID_RAW.isdigit() else None
 
 MAX_LINKS_IN_MESSAGE = int(os.getenv("MAX_LINKS_IN_MESSAGE", "30"))
+# parallel Telegram sends; Telegram allows ~1 msg/s per chat, so default to sequential
+ALERT_CONCURRENCY = max(1, int(os.getenv("ALERT_CONCURRENCY", "1")))
+TELEGRAM_MAX_ATTEMPTS = max(1, int(os.getenv("TELEGRAM_MAX_ATTEMPTS", "3")))
+
+# Shared HTTP session (keep-alive pool for Fliq + Telegram)
+SESSION = requests.Session()
+SESSION.mount("https://", HTTPAdapter(
+    pool_connections=4,
+    pool_maxsize=10,
+    max_retries=Retry(total=3, backoff_factor=0.5, status_forcelist=(429, 500, 502, 503, 504)),
+))
+SESSION.headers.update({
+    "Accept-Encoding": "gzip, deflate",
+    "Accept": "application/json",
+    "Connection": "keep-alive",
+})
 
 # Utils
 def now_iso() -> str:
@@ -54,24 +88,44 @@ def unix_to_iso(ts: Optional[int]) -> str:
     except Exception:
         return ""
 
+_RE_NONALNUM = re.compile(r"[^a-z0-9\s]")
+_RE_WS = re.compile(r"\s+")
+_RE_DASH = re.compile(r"-+")
+
+@functools.lru_cache(maxsize=2048)
 def slugify_header(header: str) -> str:
     s = (header or "").lower().strip()
     s = s.replace(":", " ")
-    s = re.sub(r"[^a-z0-9\s]", " ", s)
-    s = re.sub(r"\s+", "-", s)
-    s = re.sub(r"-+", "-", s)
+    s = _RE_NONALNUM.sub(" ", s)
+    s = _RE_WS.sub("-", s)
+    s = _RE_DASH.sub("-", s)
     return s.strip("-")
 
 def log(msg: str) -> None:
     print(f"[{now_iso()}] {msg}")
 
+def json_loads(data: bytes) -> Any:
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+def json_dumps_pretty(obj: Any) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2 | orjson.OPT_SORT_KEYS)
+    return json.dumps(obj, indent=2, ensure_ascii=False, sort_keys=True).encode("utf-8")
+
 # Storage helpers
+# sha1 of the snapshot bytes last read from / written to MATCHES_FILE
+_last_saved_hash: Optional[bytes] = None
+
 def load_matches() -> Dict[str, Any]:
+    global _last_saved_hash
     if not MATCHES_FILE.exists():
         return {}
     try:
-        with MATCHES_FILE.open("r", encoding="utf-8") as f:
-            data = json.load(f)
+        raw = MATCHES_FILE.read_bytes()
+        _last_saved_hash = hashlib.sha1(raw).digest()
+        data = json_loads(raw)
         return data if isinstance(data, dict) else {}
     except json.JSONDecodeError:
         log("snapshot file invalid JSON, starting fresh")
@@ -81,30 +135,80 @@ def load_matches() -> Dict[str, Any]:
         return {}
 
 def save_matches(data: Dict[str, Any]) -> None:
+    global _last_saved_hash
+    tmp = MATCHES_FILE.with_suffix(".json.tmp")
     try:
-        with MATCHES_FILE.open("w", encoding="utf-8") as f:
-            json.dump(data, f, indent=2, ensure_ascii=False, sort_keys=True)
+        payload = json_dumps_pretty(data)
+        new_hash = hashlib.sha1(payload).digest()
+        if new_hash == _last_saved_hash and MATCHES_FILE.exists():
+            log("snapshot unchanged, skipping write")
+            return
+        tmp.write_bytes(payload)
+        os.replace(tmp, MATCHES_FILE)
+        _last_saved_hash = new_hash
     except Exception as e:
         log(f"failed to save snapshot: {e}")
+        try:
+            tmp.unlink(missing_ok=True)
+        except Exception:
+            pass
 
-def append_removed_log(entry: str) -> None:
+def load_fetch_cache() -> Dict[str, Any]:
+    if not FETCH_CACHE_FILE.exists():
+        return {}
+    try:
+        data = json_loads(FETCH_CACHE_FILE.read_bytes())
+        return data if isinstance(data, dict) else {}
+    except Exception as e:
+        log(f"failed loading fetch cache: {e}")
+        return {}
+
+def save_fetch_cache(cache: Dict[str, Any]) -> None:
+    try:
+        if orjson is not None:
+            FETCH_CACHE_FILE.write_bytes(orjson.dumps(cache))
+        else:
+            FETCH_CACHE_FILE.write_text(json.dumps(cache, ensure_ascii=False), encoding="utf-8")
+    except Exception as e:
+        log(f"failed to save fetch cache: {e}")
+
+def append_removed_log(entries: List[str]) -> None:
+    if not entries:
+        return
     try:
         REMOVED_LOG_PATH.parent.mkdir(parents=True, exist_ok=True)
+        ts = now_iso()
         with REMOVED_LOG_PATH.open("a", encoding="utf-8") as f:
-            f.write(f"[{now_iso()}] {entry}\n")
+            f.writelines(f"[{ts}] {e}\n" for e in entries)
     except Exception as e:
         log(f"failed to append removed log: {e}")
 
+def format_removed_entry(key: str, match: Dict[str, Any]) -> str:
+    if REMOVED_LOG_VERBOSE:
+        return f"Removed: {key} data={json.dumps(match, ensure_ascii=False)}"
+    return f"Removed: {key} mid={match.get('multi_question_id', '')} end={match.get('questionEndTime_iso', '')}"
+
 # Fliq API
-def fetch_questions(limit: int = FETCH_LIMIT) -> List[Dict[str, Any]]:
+def _iter_questions(r: requests.Response) -> Iterator[Dict[str, Any]]:
+    # stream "questions" items one by one; the response is released once drained
+    try:
+        r.raw.decode_content = True
+        yield from ijson.items(r.raw, "questions.item", use_float=True)
+    finally:
+        r.close()
+
+def fetch_questions(limit: int = FETCH_LIMIT, cache: Optional[Dict[str, Any]] = None) -> Optional[Iterable[Dict[str, Any]]]:
+    """
+    Fetch questions from Fliq. When `cache` holds validators from a previous
+    run a conditional GET is sent; returns None on 304 (unchanged). On 200 the
+    new ETag / Last-Modified are written back into `cache`.
+
+    With ijson installed the questions are returned as a lazy iterator parsed
+    straight off the socket, so the full payload is never held in memory.
+    """
     params = [
         ("select", "questionId"),
-        ("select", "lotSize"),
-        ("select", "tickSize"),
-        ("select", "decimal"),
         ("select", "isSettled"),
-        ("select", "settlementPrice"),
-        ("select", "contractAddress"),
         ("select", "yesTokenMarketId"),
         ("select", "noTokenMarketId"),
         ("select", "blockchainMetadata"),
@@ -113,84 +217,116 @@ def fetch_questions(limit: int = FETCH_LIMIT) -> List[Dict[str, Any]]:
         ("metadataSelect", "parentQuestionHeader"),
         ("metadataSelect", "questionHeaderExpanded"),
         ("metadataSelect", "category"),
-        ("metadataSelect", "tags"),
         ("metadataSelect", "questionEndTime"),
-        ("metadataSelect", "imgUrl"),
-        ("metadataSelect", "tweetId"),
-        ("metadataSelect", "partnerTag"),
-        ("metadataSelect", "isMadeByTemplate"),
         ("limit", str(limit)),
     ]
-    r = requests.get(API_BASE, params=params, timeout=REQUEST_TIMEOUT)
-    r.raise_for_status()
-    j = r.json()
+    headers: Dict[str, str] = {}
+    if cache is not None and "snapshot" in cache:
+        if cache.get("etag"):
+            headers["If-None-Match"] = cache["etag"]
+        if cache.get("last_modified"):
+            headers["If-Modified-Since"] = cache["last_modified"]
+    stream = ijson is not None
+    r = SESSION.get(API_BASE, params=params, headers=headers, timeout=REQUEST_TIMEOUT, stream=stream)
+    if r.status_code == 304:
+        r.close()
+        return None
+    if not r.ok:
+        r.close()
+        r.raise_for_status()
+    if cache is not None:
+        cache["etag"] = r.headers.get("ETag") or ""
+        cache["last_modified"] = r.headers.get("Last-Modified") or ""
+    if stream:
+        return _iter_questions(r)
+    j = json_loads(r.content)
     return j.get("questions", []) if isinstance(j, dict) else []
 
-def looks_like_upcoming_match(q: Dict[str, Any]) -> bool:
-    bm = q.get("blockchainMetadata") or {}
-    category = (bm.get("category") or "").lower()
+def upcoming_match_end_ts(q: Dict[str, Any], bm: Dict[str, Any], now_ts: int) -> Optional[int]:
+    """
+    Return the question's end timestamp if it is an unsettled, not yet ended
+    football "Match Result" question, else None.
+    """
+    if (bm.get("category") or "").lower() != "football":
+        return None
     headers = " ".join([
         str(bm.get("questionHeader") or ""),
         str(bm.get("parentQuestionHeader") or ""),
         str(bm.get("questionHeaderExpanded") or "")
     ]).lower()
-    if category != "football":
-        return False
     if "match result" not in headers:
-        return False
+        return None
     if q.get("isSettled") is True:
-        return False
+        return None
     try:
         end_ts = int(bm.get("questionEndTime") or 0)
     except Exception:
-        return False
-    now_ts = int(datetime.now(timezone.utc).timestamp())
-    return end_ts > now_ts
+        return None
+    return end_ts if end_ts > now_ts else None
 
-def build_market_url(match: Dict[str, Any]) -> str:
-    slug = match.get("slug")
-    mid = match.get("multi_question_id")
+def market_url(slug: Optional[str], mid: Any) -> str:
     if not slug or not mid:
-        return "(URL unavailable)"
+        return ""
     return f"{BASE_MARKET_URL}/{slug}-{mid}?referral={REFERRAL_CODE}"
 
+def build_market_url(match: Dict[str, Any]) -> str:
+    url = match.get("url") or market_url(match.get("slug"), match.get("multi_question_id"))
+    return url or "(URL unavailable)"
+
 def build_current_matches_snapshot(require_approved: bool = REQUIRE_APPROVED) -> Dict[str, Any]:
-    questions = fetch_questions(limit=FETCH_LIMIT)
-    candidates = [q for q in questions if looks_like_upcoming_match(q)]
+    cache = load_fetch_cache()
+    questions = fetch_questions(limit=FETCH_LIMIT, cache=cache)
+    now_ts = int(time.time())
+    if questions is None:
+        log("fliq payload unchanged (304), reusing cached groups")
+        # matches may have kicked off since the cache was written
+        groups = {k: v for k, v in (cache.get("snapshot") or {}).items() if (v.get("questionEndTime") or 0) > now_ts}
+        # rebuild urls so REFERRAL_CODE / BASE_MARKET_URL changes apply to cached groups
+        for v in groups.values():
+            v["url"] = market_url(v.get("slug"), v.get("multi_question_id"))
+        if require_approved:
+            groups = {k: v for k, v in groups.items() if v.get("is_approved", False)}
+        return groups
     groups: Dict[str, Dict[str, Any]] = {}
-    for q in candidates:
+    for q in questions:
         bm = q.get("blockchainMetadata") or {}
+        end_ts = upcoming_match_end_ts(q, bm, now_ts)
+        if end_ts is None:
+            continue
         parent_header = bm.get("parentQuestionHeader") or ""
         parent_id = bm.get("parentQuestionId")
         if not parent_header or not parent_id:
             continue
         key = parent_header.strip()
-        try:
-            end_ts = int(bm.get("questionEndTime") or 0)
-        except Exception:
-            end_ts = None
         if key not in groups:
+            slug = slugify_header(parent_header)
             groups[key] = {
                 "match_header": parent_header,
-                "slug": slugify_header(parent_header),
+                "slug": slug,
                 "multi_question_id": str(parent_id),
+                "url": market_url(slug, parent_id),
                 "options": [],
                 "questionEndTime": end_ts,
                 "questionEndTime_iso": unix_to_iso(end_ts) if end_ts else "",
                 "is_approved": False,
             }
+        group = groups[key]
         yes = q.get("yesTokenMarketId")
         no = q.get("noTokenMarketId")
-        tradable = bool(yes) and bool(no) and str(yes) != "0" and str(no) != "0"
-        groups[key]["options"].append({
+        ys = str(yes) if yes else ""
+        ns = str(no) if no else ""
+        tradable = bool(ys) and bool(ns) and ys != "0" and ns != "0"
+        group["options"].append({
             "questionId": str(q.get("questionId")),
             "title": (bm.get("questionHeaderExpanded") or bm.get("questionHeader") or "").strip(),
-            "yesTokenMarketId": str(yes) if yes else "",
-            "noTokenMarketId": str(no) if no else "",
+            "yesTokenMarketId": ys,
+            "noTokenMarketId": ns,
             "option_is_tradable": tradable,
         })
         if tradable:
-            groups[key]["is_approved"] = True
+            group["is_approved"] = True
+    cache["snapshot"] = groups
+    save_fetch_cache(cache)
     if require_approved:
         groups = {k: v for k, v in groups.items() if v.get("is_approved", False)}
     return groups
@@ -207,9 +343,60 @@ def send_telegram_via_http(text: str) -> None:
         "parse_mode": "Markdown",
         "disable_web_page_preview": False,
     }
-    r = requests.post(url, json=payload, timeout=REQUEST_TIMEOUT)
+    for attempt in range(1, TELEGRAM_MAX_ATTEMPTS + 1):
+        r = SESSION.post(url, json=payload, timeout=REQUEST_TIMEOUT)
+        if r.status_code != 429 or attempt == TELEGRAM_MAX_ATTEMPTS:
+            break
+        # rate limited: Telegram says how long to back off in parameters.retry_after
+        try:
+            retry_after = int(r.json().get("parameters", {}).get("retry_after") or 1)
+        except Exception:
+            retry_after = int(r.headers.get("Retry-After") or 1)
+        log(f"telegram rate limited, retrying in {retry_after}s")
+        time.sleep(retry_after)
     r.raise_for_status()
 
+_ALERT_TMPL = (
+    "*New Match Result match detected*\n"
+    "Match: {hdr}\n"
+    "End time (UTC): {end}\n"
+    "First detected at (local): {first}\n\n"
+    "Options:\n{opts}\n\n"
+    "Link: {url}"
+)
+
+def format_alert(m: Dict[str, Any]) -> str:
+    opts = "\n".join([f"- [{o['questionId']}] {o['title']}" for o in m.get("options", [])])
+    return _ALERT_TMPL.format(
+        hdr=m.get("match_header"),
+        end=m.get("questionEndTime_iso"),
+        first=m.get("first_detected_at"),
+        opts=opts,
+        url=build_market_url(m),
+    )
+
+def send_alerts(alerts: List[Tuple[str, str]]) -> List[str]:
+    """
+    Send (key, message) alerts over the shared session, in order unless
+    ALERT_CONCURRENCY > 1. Returns the keys whose alert could not be sent.
+    """
+    def _send(alert: Tuple[str, str]) -> Optional[str]:
+        k, msg = alert
+        try:
+            send_telegram_via_http(msg)
+            log(f"alert sent for {k}")
+            return None
+        except Exception as e:
+            log(f"failed to send alert for {k}: {e}")
+            return k
+
+    if ALERT_CONCURRENCY <= 1 or len(alerts) <= 1:
+        results = [_send(alert) for alert in alerts]
+    else:
+        with ThreadPoolExecutor(max_workers=min(ALERT_CONCURRENCY, len(alerts))) as pool:
+            results = list(pool.map(_send, alerts))
+    return [k for k in results if k is not None]
+
 # Main single-run procedure
 def run_once():
     log("run start")
@@ -220,48 +407,32 @@ def run_once():
         log(f"fetch failed: {e}")
         return
 
-    saved_keys = set(saved.keys())
-    current_keys = set(current.keys())
-
-    new_keys = sorted(list(current_keys - saved_keys))
-    removed_keys = sorted(list(saved_keys - current_keys))
+    new_keys = sorted(current.keys() - saved.keys())
+    removed_keys = sorted(saved.keys() - current.keys())
 
     # carry over first_detected_at
-    for k in current_keys:
+    for k in current:
         if k in saved and "first_detected_at" in saved[k]:
             current[k]["first_detected_at"] = saved[k]["first_detected_at"]
 
     now_str = now_iso()
     if new_keys:
         log(f"new {len(new_keys)} markets")
+        alerts: List[Tuple[str, str]] = []
         for k in new_keys:
             m = current[k]
             m["first_detected_at"] = now_str
-            options_block = "\n".join(f"- [{o['questionId']}] {o['title']}" for o in m.get("options", []))
-            url = build_market_url(m)
-            msg = (
-                "*New Match Result match detected*\n"
-                f"Match: {m.get('match_header')}\n"
-                f"End time (UTC): {m.get('questionEndTime_iso')}\n"
-                f"First detected at (local): {m.get('first_detected_at')}\n\n"
-                f"Options:\n{options_block}\n\n"
-                f"Link: {url}"
-            )
-            try:
-                send_telegram_via_http(msg)
-                log(f"alert sent for {k}")
-            except Exception as e:
-                log(f"failed to send alert for {k}: {e}")
+            alerts.append((k, format_alert(m)))
+        failed = send_alerts(alerts)
+        # leave unsent markets out of the snapshot so they are alerted again next run
+        for k in failed:
+            current.pop(k, None)
     else:
         log("no new markets")
 
     if removed_keys:
         log(f"removed {len(removed_keys)} markets")
-        for k in removed_keys:
-            try:
-                append_removed_log(f"Removed: {k} data={json.dumps(saved.get(k, {}), ensure_ascii=False)}")
-            except Exception as e:
-                log(f"failed writing removed log for {k}: {e}")
+        append_removed_log([format_removed_entry(k, saved.get(k, {})) for k in removed_keys])
 
     # persist current snapshot
     save_matches(current)